@@ -4,8 +4,17 @@ TEMP_MSB_REG      = 0x00
 TEMP_LSB_REG      = 0x01
 STATUS_REG        = 0x02
 CONFIGURATION_REG = 0x03
+T_HIGH_MSB_REG    = 0x04
+T_LOW_MSB_REG     = 0x06
+T_CRIT_MSB_REG    = 0x08
+T_HYST_REG        = 0x0A
 WHO_AM_I_REG      = 0x0B
 
+STATUS_NOT_READY      = 0x80
+STATUS_T_CRIT         = 0x40
+STATUS_T_HIGH         = 0x20
+STATUS_T_LOW          = 0x10
+
 BIT13_RESOLUTION      = 0x00
 BIT16_RESOLUTION      = 0x80
 
@@ -30,57 +39,120 @@ BIT16_OP_MODE_4FAULT  = 0x03
 
 SLAVE_ADDRESS     = 0x48
 
+# One-shot conversion time (ms), sensor goes to shutdown afterwards
+ONESHOT_CONVERSION_MS = 240
+
+# Operating temperature range (celcius)
+TEMP_RANGE_MIN        = -55.0
+TEMP_RANGE_MAX        = 150.0
+
 class ADT7410(object):
 
     ## Constructor
     #  @param [in] address ADT7410 I2C slave address default:0x48
-    def __init__(self, bus, address=SLAVE_ADDRESS):
+    #  @param [in] op_mode OP_MODE_CONTINUOUS, OP_MODE_SPS or OP_MODE_ONESHOT
+    #  @param [in] int_mode INTERRUPT_MODE or COMPARATOR_MODE
+    def __init__(self, bus, address=SLAVE_ADDRESS, op_mode=OP_MODE_CONTINUOUS,
+                 int_mode=INTERRUPT_MODE):
         self.address = address
         self.bus = bus
+        self.op_mode = op_mode
+        self.int_mode = int_mode
         self.configure()
 
     ## Configure Device
+    #  In one-shot mode the sensor stays in shutdown until trigger()
     def configure(self):
-        conf = BIT16_RESOLUTION | BIT16_OP_MODE_1FAULT | CT_LOW | INT_LOW | INTERRUPT_MODE | OP_MODE_CONTINUOUS
+        op_mode = self.op_mode
+        if op_mode == OP_MODE_ONESHOT:
+            op_mode = OP_MODE_SHUTDOWN
         print('Configure ADR7410')
-        self.bus.write_byte_data(self.address, CONFIGURATION_REG, conf)
+        self.write_config(op_mode)
         print('Configuration complete')
 
+    ## Write Configuration Register
+    #  @param [in] op_mode Operation mode
+    def write_config(self, op_mode):
+        self.conf = BIT16_RESOLUTION | BIT16_OP_MODE_1FAULT | CT_LOW | INT_LOW | self.int_mode | op_mode
+        self.bus.write_byte_data(self.address, CONFIGURATION_REG, self.conf)
+
+    ## Start One-Shot Conversion
+    #  Result is ready after ONESHOT_CONVERSION_MS, then sensor shuts down
+    def trigger(self):
+        self.write_config(OP_MODE_ONESHOT)
+
+    ## Shutdown Device
+    def shutdown(self):
+        self.write_config(OP_MODE_SHUTDOWN)
+
     ## Data Ready Check
     #  @retval true Data ready
     #  @retval false Data Not ready
     def checkDataReady(self):
         status = self.bus.read_byte_data(self.address, STATUS_REG)
 
-        if status & 0x80:
+        if status & STATUS_NOT_READY:
             return False
         else:
             return True
 
+    ## Set Alarm Limits
+    #  Sensor flags crossings in status register and on INT/CT pins
+    #  @param [in] low T_LOW limit (celcius)
+    #  @param [in] high T_HIGH limit (celcius)
+    #  @param [in] crit T_CRIT limit (celcius)
+    #  @param [in] hyst Hysteresis 0-15 (celcius)
+    def set_limits(self, low, high, crit=None, hyst=None):
+        self.write_temp(T_LOW_MSB_REG, low)
+        self.write_temp(T_HIGH_MSB_REG, high)
+        if crit is not None:
+            self.write_temp(T_CRIT_MSB_REG, crit)
+        if hyst is not None:
+            self.bus.write_byte_data(self.address, T_HYST_REG, int(hyst) & 0x0F)
+
+    ## Write Temperature Limit Register (16bit format)
+    def write_temp(self, reg, temp):
+        val = int(round(temp * 128.0)) & 0xFFFF
+        self.bus.write_i2c_block_data(self.address, reg, [val >> 8, val & 0xFF])
+
+    ## Read Alarm Flags
+    #  @return value STATUS_T_LOW | STATUS_T_HIGH | STATUS_T_CRIT flags
+    def alarms(self):
+        status = self.bus.read_byte_data(self.address, STATUS_REG)
+        return status & (STATUS_T_LOW | STATUS_T_HIGH | STATUS_T_CRIT)
+
     ## Read Temperature Data
-    #  @return value Temperature Data
+    #  @return value Temperature Data, None if data not ready
     def read(self):
-        if self.checkDataReady():
-            config = self.bus.read_byte_data(self.address, CONFIGURATION_REG)
-            data = self.bus.read_i2c_block_data(self.address, TEMP_MSB_REG, 2)
+        if not self.checkDataReady():
+            return None
 
-            adc = (data[0] << 8) | data[1]
-            val = adc
+        config = self.bus.read_byte_data(self.address, CONFIGURATION_REG)
+        data = self.bus.read_i2c_block_data(self.address, TEMP_MSB_REG, 2)
 
-            if config & BIT16_RESOLUTION:
-                # 16bit resolution
-                if adc & 0x8000:
-                    val = val - 65536
-                temp = float(val / 128.0)
+        # Device reset (e.g. brown-out) back to 13bit continuous mode,
+        # one-shot returns to shutdown on its own so ignore op mode then
+        mask = 0xFF
+        if self.op_mode == OP_MODE_ONESHOT:
+            mask &= ~OP_MODE_SHUTDOWN
+        if (config & mask) != (self.conf & mask):
+            print('ADT7410 configuration lost, reconfigure')
+            self.configure()
 
-            else:
-                # 13bit resolution
-                adc >>= 3
-                if adc & 0x1000:
-                    val = val - 8192
-                temp = float(val / 16.0)
+        adc = (data[0] << 8) | data[1]
 
-            return temp
+        if config & BIT16_RESOLUTION:
+            # 16bit resolution
+            val = adc
+            if adc & 0x8000:
+                val = val - 65536
+            temp = float(val / 128.0)
 
         else:
-            return 0.0
+            # 13bit resolution
+            val = adc >> 3
+            if val & 0x1000:
+                val = val - 8192
+            temp = float(val / 16.0)
+
+        return temp
@@ -0,0 +1,185 @@
+import time
+
+RULE_THRESHOLD = 'threshold'
+RULE_RATE      = 'rate'
+
+DEFAULT_COOLDOWN = 60
+
+class Rule(object):
+	"""Base alert rule, bound to a single sensor."""
+
+	type = None
+	params = ('cooldown', 'escalate')
+
+	def __init__(self, name, sensor, cooldown=DEFAULT_COOLDOWN, escalate=0):
+		self.name = name
+		self.sensor = sensor
+		self.cooldown = float(cooldown)
+		# Number of consecutive alerts before escalating (0 = never)
+		self.escalate = int(escalate)
+		self.last_sent = None
+		self.count = 0
+
+	def check(self, value, now):
+		"""Return True if the rule is triggered by value."""
+		raise NotImplementedError
+
+	def evaluate(self, value, now):
+		"""Return None, 'alert' or 'escalate'."""
+		triggered = self.check(value, now)
+		expired = (self.last_sent is None) or ((now - self.last_sent) >= self.cooldown)
+
+		if not triggered:
+			if expired:
+				self.count = 0
+			return None
+
+		if not expired:
+			print('rule ' + self.name + ' already sent ' + str(now - self.last_sent))
+			return None
+
+		self.last_sent = now
+		self.count += 1
+		if (self.escalate > 0) and (self.count >= self.escalate):
+			return 'escalate'
+		return 'alert'
+
+	def copy_state(self, rule):
+		"""Keep runtime state of rule, e.g. on parameter update."""
+		self.last_sent = rule.last_sent
+		self.count = rule.count
+
+	def to_dict(self):
+		d = { 'name': self.name, 'type': self.type, 'sensor': self.sensor }
+		for param in self.params:
+			d[param] = getattr(self, param)
+		return d
+
+	def __str__(self):
+		return ' '.join('{}={}'.format(k, v) for k, v in self.to_dict().items()
+				if v is not None)
+
+class ThresholdRule(Rule):
+	"""Triggered when value goes above/below a limit, cleared when value
+	comes back beyond the limit minus/plus hysteresis."""
+
+	type = RULE_THRESHOLD
+	params = ('above', 'below', 'hysteresis') + Rule.params
+
+	def __init__(self, name, sensor, above=None, below=None, hysteresis=0, **kwargs):
+		super(ThresholdRule, self).__init__(name, sensor, **kwargs)
+		if (above is None) == (below is None):
+			raise ValueError('threshold rule needs either above or below')
+		self.above = None if above is None else float(above)
+		self.below = None if below is None else float(below)
+		self.hysteresis = float(hysteresis)
+		self.active = False
+
+	def check(self, value, now):
+		if self.above is not None:
+			limit = self.above - self.hysteresis if self.active else self.above
+			self.active = value > limit
+		else:
+			limit = self.below + self.hysteresis if self.active else self.below
+			self.active = value < limit
+		return self.active
+
+	def copy_state(self, rule):
+		super(ThresholdRule, self).copy_state(rule)
+		self.active = rule.active
+
+class RateRule(Rule):
+	"""Triggered when value changes by at least delta since the previous
+	sample, or by delta per 'per' seconds if set."""
+
+	type = RULE_RATE
+	params = ('delta', 'per') + Rule.params
+
+	def __init__(self, name, sensor, delta, per=None, **kwargs):
+		super(RateRule, self).__init__(name, sensor, **kwargs)
+		self.delta = float(delta)
+		self.per = None if per is None else float(per)
+		self.prev = None
+
+	def check(self, value, now):
+		prev = self.prev
+		self.prev = (value, now)
+		if prev is None:
+			return False
+
+		change = abs(value - prev[0])
+		if self.per is not None:
+			if now <= prev[1]:
+				return False
+			change = change * self.per / (now - prev[1])
+		return change >= self.delta
+
+	def copy_state(self, rule):
+		super(RateRule, self).copy_state(rule)
+		self.prev = rule.prev
+
+RULE_TYPES = { RULE_THRESHOLD: ThresholdRule, RULE_RATE: RateRule }
+
+def rule_from_dict(d):
+	d = dict(d)
+	rule_type = d.pop('type', None)
+	if rule_type not in RULE_TYPES:
+		raise ValueError('unknown rule type ' + str(rule_type))
+	return RULE_TYPES[rule_type](**d)
+
+class RuleEngine(object):
+	"""Evaluate alert rules, indexed by sensor so that a new sample only
+	evaluates the rules referencing it."""
+
+	def __init__(self, alert_cb, rules=(), sensors=None):
+		self.alert_cb = alert_cb
+		# Known sensors, None to accept any
+		self.sensors = sensors
+		self.rules = {}
+		self.index = {}
+		for d in rules:
+			self.add(rule_from_dict(d))
+
+	def add(self, rule):
+		if (self.sensors is not None) and (rule.sensor not in self.sensors):
+			raise ValueError('unknown sensor ' + str(rule.sensor))
+		self.remove(rule.name)
+		self.rules[rule.name] = rule
+		self.index.setdefault(rule.sensor, []).append(rule)
+
+	def remove(self, name):
+		rule = self.rules.pop(name, None)
+		if rule is None:
+			return False
+		self.index[rule.sensor].remove(rule)
+		if not self.index[rule.sensor]:
+			del self.index[rule.sensor]
+		return True
+
+	def update(self, name, params):
+		"""Create or update rule name from a dict of (string) parameters."""
+		d = {}
+		old = self.rules.get(name)
+		if (old is not None) and (params.get('type', old.type) == old.type):
+			d = old.to_dict()
+		d.update(params)
+		d['name'] = name
+		d = { k: v for k, v in d.items() if v is not None }
+		try:
+			rule = rule_from_dict(d)
+		except TypeError as e:
+			raise ValueError(str(e))
+		if (old is not None) and (old.type == rule.type) and (old.sensor == rule.sensor):
+			rule.copy_state(old)
+		self.add(rule)
+
+	def process(self, sensor, value, now=None):
+		if now is None:
+			now = time.monotonic()
+		for rule in self.index.get(sensor, ()):
+			res = rule.evaluate(value, now)
+			if res is not None:
+				self.alert_cb(rule, value, res == 'escalate')
+
+	def to_list(self):
+		return [rule.to_dict() for rule in self.rules.values()]
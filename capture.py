@@ -0,0 +1,192 @@
+import os
+import gzip
+import time
+import datetime
+import threading
+import queue
+
+class FrameSource(object):
+	"""Frame source interface, frames are 8-bit grayscale width x height."""
+
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+
+	def read_into(self, buf):
+		"""Fill buf with the next frame, block until available."""
+		raise NotImplementedError
+
+	def close(self):
+		pass
+
+class SyntheticSource(FrameSource):
+	"""Moving gradient generator, for tests without camera."""
+
+	def __init__(self, width, height, fps=10):
+		super(SyntheticSource, self).__init__(width, height)
+		self.period = 1.0 / fps
+		self.offset = 0
+		size = width * height
+		self.pattern = memoryview(bytearray(i & 0xFF for i in range(2 * size)))
+
+	def read_into(self, buf):
+		time.sleep(self.period)
+		size = self.width * self.height
+		buf[:] = self.pattern[self.offset:self.offset + size]
+		self.offset = (self.offset + 1) % size
+
+class DeviceSource(FrameSource):
+	"""Raw frames read from a device (e.g. V4L2 read I/O). The format is
+	not negotiated, the device must already be set to GREY width x height."""
+
+	def __init__(self, path, width, height):
+		super(DeviceSource, self).__init__(width, height)
+		self.file = open(path, 'rb', buffering=0)
+
+	def read_into(self, buf):
+		if self.file.readinto(buf) != len(buf):
+			raise IOError('Short frame read')
+
+	def close(self):
+		self.file.close()
+
+class Capture(object):
+	"""Keep the last frames in a ring of preallocated buffers, and on
+	trigger() store the pre/post-trigger frames from a background worker.
+
+	Frozen frames are not copied: their buffer is swapped with a spare one
+	from the pool, and given back to the pool once stored.
+	"""
+
+	def __init__(self, source, directory, pre=10, post=10, scale=2):
+		self.source = source
+		self.directory = directory
+		self.pre = pre
+		self.post = post
+		self.scale = scale
+		size = source.width * source.height
+		# pre completed frames + the slot being captured (self.index),
+		# which is owned by the capture thread
+		self.ring = [bytearray(size) for i in range(pre + 1)]
+		self.stamps = [0.0] * len(self.ring)
+		self.index = 0
+		self.count = 0
+		# Spare buffers for one event in flight: the pre completed frames
+		# and the post frames are all swapped out of the ring
+		self.pool = [bytearray(size) for i in range(pre + post)]
+		self.event = None
+		self.lock = threading.Lock()
+		self.queue = queue.Queue()
+		self.running = True
+		os.makedirs(directory, exist_ok=True)
+
+		self.thread = threading.Thread(target=self.__capture)
+		self.thread.daemon = True
+		self.thread.start()
+		self.worker = threading.Thread(target=self.__store)
+		self.worker.daemon = True
+		self.worker.start()
+
+	def __detach(self, index):
+		# Replace ring buffer by a spare one, return the frame
+		frame = (self.stamps[index], self.ring[index])
+		self.ring[index] = self.pool.pop()
+		return frame
+
+	def __capture(self):
+		while self.running:
+			# trigger() never freezes self.index, buf stays in the ring
+			with self.lock:
+				index = self.index
+				buf = self.ring[index]
+			try:
+				self.source.read_into(buf)
+			except Exception as e:
+				print('Unable to capture frame: ' + str(e))
+				time.sleep(1)
+				continue
+
+			with self.lock:
+				self.stamps[index] = time.time()
+				self.index = (index + 1) % len(self.ring)
+				self.count += 1
+				if self.event is None:
+					continue
+
+				# Post-trigger frame
+				self.event['frames'].append(self.__detach(index))
+				self.event['post'] -= 1
+				if self.event['post'] == 0:
+					self.queue.put(self.event)
+					self.event = None
+
+	def trigger(self):
+		with self.lock:
+			if self.event is not None:
+				print('Capture already triggered')
+				return False
+			if len(self.pool) < self.pre + self.post:
+				print('Capture busy')
+				return False
+
+			# Freeze completed pre-trigger frames, oldest first (the slot
+			# being captured becomes the first post-trigger frame)
+			frames = []
+			count = min(self.count, self.pre)
+			for i in range(count):
+				index = (self.index - count + i) % len(self.ring)
+				frames.append(self.__detach(index))
+			# Detached slots hold pool buffers, only frames captured
+			# from now on are valid pre-trigger frames
+			self.count = 0
+
+			self.event = { 'time': time.time(), 'frames': frames,
+					'post': self.post }
+			if self.post == 0:
+				self.queue.put(self.event)
+				self.event = None
+		return True
+
+	def __store(self):
+		while True:
+			event = self.queue.get()
+			if event is None:
+				return
+			try:
+				self.__write(event)
+			except Exception as e:
+				print('Unable to store capture: ' + str(e))
+			with self.lock:
+				self.pool.extend(buf for ts, buf in event['frames'])
+
+	def __write(self, event):
+		name = datetime.datetime.fromtimestamp(event['time']).strftime('%Y%m%d-%H%M%S')
+		path = os.path.join(self.directory, name)
+		n = 1
+		while os.path.exists(path):
+			path = os.path.join(self.directory, '{}-{}'.format(name, n))
+			n += 1
+		os.makedirs(path)
+
+		width = self.source.width
+		scale = self.scale
+		swidth = (width + scale - 1) // scale
+		sheight = (self.source.height + scale - 1) // scale
+		for n, (ts, buf) in enumerate(event['frames']):
+			# Downscale by subsampling
+			rows = [buf[row * width:(row + 1) * width:scale]
+					for row in range(0, self.source.height, scale)]
+			with gzip.open(os.path.join(path, 'frame-{:03d}.pgm.gz'.format(n)), 'wb') as f:
+				f.write('P5\n# t={:.3f}\n{} {}\n255\n'.format(ts, swidth, sheight).encode())
+				f.write(b''.join(rows))
+		print('Capture stored in ' + path)
+
+	def events(self):
+		"""Stored capture names, oldest first."""
+		return sorted(os.listdir(self.directory))
+
+	def stop(self):
+		self.running = False
+		self.queue.put(None)
+		self.worker.join()
+		self.source.close()
@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 
 import adt7410
+import alertrules
+import capture
 import time
 import datetime
 import smbus
@@ -8,15 +10,28 @@ import dbus
 import smsmanager
 import vl53l0x
 import os
+import sys
+import math
 import json
+import threading
+import argparse
+import i2ctrace
 
 import dbus.mainloop.glib
 from gi.repository import GLib
 
 TEMPERATURE_POLL_S = 5
 RANGE_POLL_S = 1
+INIT_RETRY_S = 30
+# Full temperature sample period when gated on sensor alarms
+TEMP_GATE_SAMPLE_S = 3600
 
 I2C_BUS = 1
+ADT7410_ADDR = 0x48
+VL53L0X_ADDR = 0x29
+# Bound VL53L0X busy-wait loops, so a wedged sensor fails instead of
+# hanging init (and range polling)
+VL53L0X_IO_TIMEOUT_S = 1
 sensor_temp = 0
 sensor_range = 0
 sms = 0
@@ -37,6 +52,41 @@ CMD_UNREGISTER = 'UNREGISTER'
 CMD_REBOOT     = 'REBOOT'
 CMD_TIME       = 'TIME'
 CMD_DATE       = 'DATE'
+CMD_MODEM      = 'MODEM'
+CMD_CAPTURES   = 'CAPTURES'
+CMD_RULES      = 'RULES'
+CMD_RULE       = 'RULE'
+CMD_RULE_DEL   = 'DELETE'
+
+# Devices, the i2c sensors are initialized in worker threads while the
+# sms manager (dbus) stays in the main thread.
+DEV_TEMP  = 'temp'
+DEV_RANGE = 'range'
+DEV_SMS   = 'sms'
+DEV_CAPTURE = 'capture'
+DEVICES = (DEV_TEMP, DEV_RANGE, DEV_SMS)
+I2C_DEVICES = (DEV_TEMP, DEV_RANGE)
+
+DEFAULT_RULES = [
+	{ 'name': 'temp-min', 'type': alertrules.RULE_THRESHOLD, 'sensor': DEV_TEMP,
+	  'below': TEMP_MIN_ALERT, 'hysteresis': 1, 'cooldown': 3600 },
+	{ 'name': 'temp-max', 'type': alertrules.RULE_THRESHOLD, 'sensor': DEV_TEMP,
+	  'above': TEMP_MAX_ALERT, 'hysteresis': 1, 'cooldown': 3600 },
+	{ 'name': 'movement', 'type': alertrules.RULE_RATE, 'sensor': DEV_RANGE,
+	  'delta': RANGE_DIFF_TRIGGER_MM, 'cooldown': ALERT_TIMEOUT },
+]
+
+# Temperature sampling modes ('temp-mode' conf), oneshot and sps keep the
+# sensor in shutdown/idle between samples
+TEMP_MODES = {
+	'continuous': adt7410.OP_MODE_CONTINUOUS,
+	'sps': adt7410.OP_MODE_SPS,
+	'oneshot': adt7410.OP_MODE_ONESHOT,
+}
+TEMP_INT_MODES = {
+	'interrupt': adt7410.INTERRUPT_MODE,
+	'comparator': adt7410.COMPARATOR_MODE,
+}
 
 class CellularMonitor(object):
 
@@ -44,21 +94,168 @@ class CellularMonitor(object):
 	temp_max = -99.0
 	temp_inst = 0
 	range_inst = 0
-	last_alert = 0
 	config = {}
+	sensor_temp = None
+	sensor_range = None
+	sms = None
+	capture = None
+	temp_alarm = False
+	temp_gate_last = None
+
+	def __init__(self, config="/etc/cellularmonitor.json", record=None, replay=None):
+		self.start_time = time.monotonic()
+		self.init_times = {}
+		self.retrying = False
+		self.clock = time.monotonic
+		self.trace = None
+		self.replay_bus = None
+		self.replay_error = None
+		devices = DEVICES
+
+		if (replay is not None):
+			# Sensors only, driven by the trace clock
+			print('Replay trace ' + replay)
+			self.replay_bus = i2ctrace.ReplayBus(replay)
+			self.clock = self.replay_bus.clock
+			devices = I2C_DEVICES
+		else:
+			if (record is not None):
+				print('Record trace ' + record)
+				self.trace = i2ctrace.TraceWriter(record)
+			print('Init DBUS')
+			dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+			dbus.mainloop.glib.threads_init()
 
-	def __init__(self, config="/etc/cellularmonitor.json"):
-		print('Init DBUS')
-		dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-		print('Init temperature sensor')
-		self.sensor_temp = adt7410.ADT7410(smbus.SMBus(I2C_BUS), 0x48)
-		print('Init range sensor')
-		self.sensor_range = vl53l0x.VL53L0X(smbus.SMBus(I2C_BUS), 0x29)
-		print('Init sms manager')
-		self.sms = smsmanager.SMSManager(self.sms_callback)
 		print('Load config')
 		self.conf_file = config
 		self.load_config()
+		self.load_rules()
+		if (self.trace is not None):
+			self.trace_rules()
+		if (self.replay_bus is not None):
+			self.replay_rules()
+		if (replay is None) and ('capture' in self.config):
+			devices = devices + (DEV_CAPTURE,)
+		self.failed = self.init_devices(devices)
+		print('Init done in {:.3f}s'.format(time.monotonic() - self.start_time))
+
+	def i2c_bus(self):
+		if (self.replay_bus is not None):
+			return self.replay_bus
+		bus = smbus.SMBus(I2C_BUS)
+		if (self.trace is not None):
+			bus = i2ctrace.TraceBus(bus, self.trace)
+		return bus
+
+	def trace_mark(self, address, kind):
+		# Mark sampler entry points in the trace, replay dispatches on them
+		bus = self.replay_bus or self.trace
+		if (bus is not None):
+			bus.mark(address, kind)
+
+	def init_temp(self):
+		self.trace_mark(ADT7410_ADDR, i2ctrace.MARK_INIT)
+		sensor = adt7410.ADT7410(self.i2c_bus(), ADT7410_ADDR,
+					op_mode=TEMP_MODES[self.config['temp-mode']],
+					int_mode=TEMP_INT_MODES[self.config['temp-int']])
+		self.temperature_program(sensor)
+		self.sensor_temp = sensor
+
+	def init_range(self):
+		self.trace_mark(VL53L0X_ADDR, i2ctrace.MARK_INIT)
+		self.sensor_range = vl53l0x.VL53L0X(self.i2c_bus(), VL53L0X_ADDR,
+					io_timeout_s=VL53L0X_IO_TIMEOUT_S)
+
+	def init_sms(self):
+		self.sms = smsmanager.SMSManager(self.sms_callback)
+
+	def init_capture(self):
+		# e.g. { "source": "/dev/video0", "width": 320, "height": 240 }
+		conf = self.config['capture']
+		source = conf.get('source', 'synthetic')
+		width = conf.get('width', 320)
+		height = conf.get('height', 240)
+		if (source == 'synthetic'):
+			source = capture.SyntheticSource(width, height, conf.get('fps', 10))
+		else:
+			source = capture.DeviceSource(source, width, height)
+		self.capture = capture.Capture(source,
+				conf.get('dir', '/var/lib/cellularmonitor/capture'),
+				pre=conf.get('pre', 10), post=conf.get('post', 10),
+				scale=conf.get('scale', 2))
+
+	def init_device(self, name, results):
+		print('Init ' + name)
+		start = time.monotonic()
+		try:
+			getattr(self, 'init_' + name)()
+			results[name] = True
+		except i2ctrace.TraceMismatch as e:
+			# Trace does not match this driver/conf, abort replay
+			self.replay_error = e
+			results[name] = False
+		except Exception as e:
+			print('Unable to init ' + name + ': ' + str(e))
+			results[name] = False
+		self.init_times[name] = time.monotonic() - start
+		print('Init {} {} in {:.3f}s'.format(name,
+			'done' if results[name] else 'failed', self.init_times[name]))
+
+	def init_devices(self, names):
+		# Devices are independent, initialize them concurrently
+		# Return the list of devices which failed to initialize
+		results = {}
+		threads = []
+		for name in names:
+			if name not in I2C_DEVICES:
+				continue
+			t = threading.Thread(target=self.init_device, args=(name, results))
+			t.start()
+			threads.append(t)
+
+		for name in names:
+			if name not in I2C_DEVICES:
+				self.init_device(name, results)
+
+		for t in threads:
+			t.join()
+
+		return [name for name in names if not results[name]]
+
+	def init_retry(self):
+		if self.retrying:
+			return True
+
+		print('Retry init: ' + ','.join(self.failed))
+		self.retrying = True
+
+		# dbus objects must be created from the main loop context
+		failed = [name for name in self.failed if name not in I2C_DEVICES]
+		failed = self.init_devices(failed)
+
+		sensors = [name for name in self.failed if name in I2C_DEVICES]
+		t = threading.Thread(target=self.init_retry_worker, args=(sensors, failed))
+		t.daemon = True
+		t.start()
+		return True
+
+	def init_retry_worker(self, sensors, failed):
+		failed = failed + self.init_devices(sensors)
+		GLib.idle_add(self.init_retry_done, failed)
+
+	def init_retry_done(self, failed):
+		recovered = [name for name in self.failed if name not in failed]
+		self.failed = failed
+		self.retrying = False
+
+		if recovered:
+			self.send_event('RECOVERED: ' + ','.join(recovered))
+
+		if not self.failed:
+			print('All devices initialized')
+			GLib.source_remove(self.retry_source)
+
+		return False
 
 	def load_config(self):
 		try:
@@ -71,6 +268,57 @@ class CellularMonitor(object):
 			self.config['auth-code'] = '1234'
 		if ('auth-list' not in self.config):
 			self.config['auth-list'] = []
+		if ('rules' not in self.config):
+			self.config['rules'] = DEFAULT_RULES
+		if (self.config.get('temp-mode') not in TEMP_MODES):
+			self.config['temp-mode'] = 'continuous'
+		if (self.config.get('temp-int') not in TEMP_INT_MODES):
+			self.config['temp-int'] = 'interrupt'
+		if ('temp-gate' not in self.config):
+			self.config['temp-gate'] = False
+		if ('temp-poll' not in self.config):
+			self.config['temp-poll'] = TEMPERATURE_POLL_S
+
+	def load_rules(self):
+		self.rules = alertrules.RuleEngine(self.alert_callback,
+					sensors=(DEV_TEMP, DEV_RANGE))
+		for d in self.config['rules']:
+			try:
+				self.rules.add(alertrules.rule_from_dict(d))
+			except (ValueError, TypeError) as e:
+				print('Invalid rule ' + str(d) + ': ' + str(e))
+
+	def trace_rule(self, d):
+		# Record rule (d) or rules reset (None) in the trace, rules come
+		# from the trace and not from the (edited) conf file on replay
+		data = json.dumps(d, separators=(',', ':')).encode()
+		self.trace.mark(i2ctrace.MONITOR_ADDRESS, i2ctrace.MARK_RULE, data)
+
+	def trace_rules(self):
+		self.trace_rule(None)
+		for rule in self.rules.rules.values():
+			self.trace_rule(rule.to_dict())
+
+	def replay_rule(self):
+		data = self.replay_bus.mark(i2ctrace.MONITOR_ADDRESS, i2ctrace.MARK_RULE)
+		d = json.loads(data.decode())
+		if (d is None):
+			self.rules = alertrules.RuleEngine(self.alert_callback,
+						sensors=(DEV_TEMP, DEV_RANGE))
+		elif (len(d) == 1):
+			self.rules.remove(d['name'])
+		else:
+			self.rules.update(d['name'], d)
+
+	def replay_rules(self):
+		# Rules snapshot recorded before any device transaction
+		first = [self.replay_bus.peek(address) for address in (ADT7410_ADDR, VL53L0X_ADDR)]
+		first = min([record[0] for record in first if record] or [float('inf')])
+		while True:
+			record = self.replay_bus.peek(i2ctrace.MONITOR_ADDRESS)
+			if (record is None) or (record[0] > first):
+				break
+			self.replay_rule()
 
 	def save_config(self):
 		try:
@@ -87,11 +335,85 @@ class CellularMonitor(object):
 		if ('contact' not in self.config):
 			print('No contact')
 			return
+		if (self.sms is None):
+			print('No sms manager, event: ' + message)
+			return
 		try:
 			self.sms.send(self.config['contact'], message)
 		except:
 			print('Unable to send message')
 
+	def alert_callback(self, rule, value, escalate):
+		message = 'ALERT: {} ({:g})'.format(rule.name, value)
+		print(message)
+		if (rule.sensor == DEV_RANGE) and (self.capture is not None):
+			self.capture.trigger()
+		if not escalate:
+			self.send_event(message)
+			return
+
+		# Escalation, notify every authenticated number
+		message = 'ESCALATED ' + message
+		if (self.sms is None):
+			print('No sms manager, event: ' + message)
+			return
+		numbers = set(self.config['auth-list'])
+		if (self.config.get('contact')):
+			numbers.add(self.config['contact'])
+		for number in numbers:
+			try:
+				self.sms.send(number, message)
+			except:
+				print('Unable to send message')
+
+	def rule_command(self, message, number):
+		# RULE name: show rule
+		# RULE name DELETE: delete rule
+		# RULE name key=value...: create or update rule
+		if (self.number_is_authenticated(number) == False):
+			return ''
+
+		args = message.lower().split()[1:]
+		if not args:
+			return 'RULE ERROR'
+
+		name = args[0]
+		if (len(args) == 1):
+			rule = self.rules.rules.get(name)
+			return str(rule) if rule else 'NO RULE ' + name
+
+		if (args[1].upper() == CMD_RULE_DEL):
+			if not self.rules.remove(name):
+				return 'NO RULE ' + name
+			if (self.trace is not None):
+				self.trace_rule({ 'name': name })
+			resp = 'RULE DELETED'
+		else:
+			params = {}
+			for arg in args[1:]:
+				key, sep, val = arg.partition('=')
+				if not sep:
+					return 'RULE ERROR ' + arg
+				params[key] = None if val == 'none' else val
+			try:
+				self.rules.update(name, params)
+			except ValueError as e:
+				return 'RULE ERROR ' + str(e)
+			resp = str(self.rules.rules[name])
+			if (self.trace is not None):
+				self.trace_rule(self.rules.rules[name].to_dict())
+
+		self.config['rules'] = self.rules.to_list()
+		self.save_config()
+		if (self.sensor_temp is not None):
+			try:
+				self.temperature_program(self.sensor_temp)
+			except i2ctrace.TraceMismatch:
+				raise
+			except:
+				print('Unable to program temperature limits')
+		return resp
+
 	def number_is_authenticated(self, number):
 		if ('auth-list' in self.config):
 			if (number in self.config['auth-list']):
@@ -104,6 +426,9 @@ class CellularMonitor(object):
 
 		message = message.upper()
 		if (message == CMD_TEMP_GET):
+			# Fresh value on demand, except in oneshot (needs a conversion)
+			if (self.sensor_temp is not None) and (self.config['temp-mode'] != 'oneshot'):
+				self.temperature_sample()
 			resp = 'temp: inst={:.2f};min={:.2f};max={:.2f}'.format(self.temp_inst, self.temp_min, self.temp_max)
 		elif (message == CMD_RANGE_GET):
 			resp = 'range: {}mm'.format(self.range_inst)
@@ -116,6 +441,20 @@ class CellularMonitor(object):
 			self.config['contact'] = number
 			self.save_config()
 			resp = 'REGISTERED'
+		elif (message == CMD_MODEM):
+			resp = self.sms.status()
+		elif (message == CMD_CAPTURES):
+			if (self.capture is None):
+				resp = 'NO CAPTURE'
+			else:
+				events = self.capture.events()
+				resp = 'captures: {}'.format(len(events))
+				if events:
+					resp += ';last=' + events[-1]
+		elif (message == CMD_RULES):
+			resp = 'rules: ' + ','.join(sorted(self.rules.rules))
+		elif (message.startswith(CMD_RULE + ' ')):
+			resp = self.rule_command(message, number)
 		elif (message == CMD_UNREGISTER):
 			self.config['contact'] = None
 			self.save_config()
@@ -160,51 +499,210 @@ class CellularMonitor(object):
 			print('Unable to send message')
 
 	def temperature_poll(self):
+		if (self.sensor_temp is None):
+			GLib.timeout_add_seconds(self.config['temp-poll'], self.temperature_poll)
+			return
+
+		delay = self.temperature_start()
+		if (delay is None):
+			GLib.timeout_add_seconds(self.config['temp-poll'], self.temperature_poll)
+		elif (delay > 0):
+			# Duty-cycled, wait for conversion without blocking
+			GLib.timeout_add(delay, self.temperature_read)
+		else:
+			self.temperature_read()
+
+	def temperature_start(self):
+		# Start a temperature sample, shared by live and replay pollers
+		# Return the delay (ms) before reading it, None to skip the sample
+		self.trace_mark(ADT7410_ADDR, i2ctrace.MARK_START)
+		if (self.config['temp-mode'] != 'oneshot'):
+			return None if self.temperature_gated() else 0
+
 		try:
-			self.temp_inst = self.sensor_temp.read()
+			self.sensor_temp.trigger()
+		except i2ctrace.TraceMismatch:
+			raise
+		except:
+			print('Unable to trigger temperature conversion')
+			return None
+		return adt7410.ONESHOT_CONVERSION_MS
+
+	def temperature_limits(self):
+		# Sensor (low, high, hyst) limits from the temp threshold rules,
+		# None if some temp rule is not a threshold (needs every sample)
+		above = []
+		below = []
+		hyst = 0
+		for rule in self.rules.index.get(DEV_TEMP, ()):
+			if (rule.type != alertrules.RULE_THRESHOLD):
+				return None
+			if (rule.above is not None):
+				above.append(rule.above)
+			else:
+				below.append(rule.below)
+			hyst = max(hyst, rule.hysteresis)
+		low = max(below) if below else adt7410.TEMP_RANGE_MIN
+		high = min(above) if above else adt7410.TEMP_RANGE_MAX
+		return (low, high, min(int(math.ceil(hyst)), 15))
+
+	def temperature_gate_enabled(self):
+		# Comparator mode keeps flags set while beyond a limit, so rules
+		# still get consecutive samples (cooldown, escalation)
+		return (self.config['temp-gate'] and
+			(self.config['temp-mode'] == 'sps') and
+			(self.config['temp-int'] == 'comparator') and
+			(self.temperature_limits() is not None))
+
+	def temperature_program(self, sensor):
+		# Program the sensor limits from the temp threshold rules
+		self.trace_mark(ADT7410_ADDR, i2ctrace.MARK_PROGRAM)
+		if not self.temperature_gate_enabled():
+			return
+		low, high, hyst = self.temperature_limits()
+		print('Temperature limits low={} high={} hyst={}'.format(low, high, hyst))
+		sensor.set_limits(low, high, hyst=hyst)
+
+	def temperature_gated(self):
+		# When gated, only read temperature and run the rules when the
+		# sensor flags a crossing, once when the flag clears (so rules see
+		# the value back within limits), and every TEMP_GATE_SAMPLE_S
+		if not self.temperature_gate_enabled():
+			return False
+		try:
+			alarm = self.sensor_temp.alarms()
+		except i2ctrace.TraceMismatch:
+			raise
+		except:
+			print('Unable to retrieve temperature alarms')
+			return False
+
+		now = self.clock()
+		if (alarm or self.temp_alarm or (self.temp_gate_last is None) or
+		    ((now - self.temp_gate_last) >= TEMP_GATE_SAMPLE_S)):
+			self.temp_alarm = bool(alarm)
+			self.temp_gate_last = now
+			return False
+		return True
+
+	def temperature_read(self):
+		GLib.timeout_add_seconds(self.config['temp-poll'], self.temperature_poll)
+		self.temperature_sample()
+
+	def temperature_sample(self):
+		self.trace_mark(ADT7410_ADDR, i2ctrace.MARK_SAMPLE)
+		try:
+			temp = self.sensor_temp.read()
+		except i2ctrace.TraceMismatch:
+			raise
 		except:
 			print('Unable to retrieve temperature')
-			GLib.timeout_add_seconds(TEMPERATURE_POLL_S, self.temperature_poll)
 			return
 
+		if (temp is None):
+			print('Temperature not ready')
+			return
+
+		self.temp_inst = temp
 		self.temp_min = min(self.temp_inst, self.temp_min)
 		self.temp_max = max(self.temp_inst, self.temp_max)
-
-		GLib.timeout_add_seconds(TEMPERATURE_POLL_S, self.temperature_poll)
+		self.rules.process(DEV_TEMP, self.temp_inst, self.clock())
 
 	def range_poll(self):
+		if (self.sensor_range is not None):
+			self.range_sample()
+
+		# Reschedule
+		GLib.timeout_add_seconds(RANGE_POLL_S, self.range_poll)
+
+	def range_sample(self):
+		self.trace_mark(VL53L0X_ADDR, i2ctrace.MARK_SAMPLE)
 		try:
 			range = self.sensor_range.read()
+		except i2ctrace.TraceMismatch:
+			raise
 		except:
 			print('Unable to retrieve range')
-			GLib.timeout_add_seconds(RANGE_POLL_S, self.range_poll)
 			return
 
 		# Filter non-valid
 		if (range == 0):
-			GLib.timeout_add_seconds(RANGE_POLL_S, self.range_poll)
 			return
 
-		# Check if change changed
-		if ((self.range_inst != 0) and (abs(self.range_inst - range) >=  RANGE_DIFF_TRIGGER_MM)):
-			print('ALERT')
-			now = time.monotonic()
-			if ((now - self.last_alert) > ALERT_TIMEOUT):
-				self.last_alert = now
-				self.send_event("ALERT: movement")
-			else:
-				print("alert already sent " + str(now - self.last_alert))
+		self.rules.process(DEV_RANGE, range, self.clock())
 
 		# Save
 		self.range_inst = range
 
-		# Reschedule
-		GLib.timeout_add_seconds(RANGE_POLL_S, self.range_poll)
+	def replay_init(self, name):
+		results = {}
+		self.init_device(name, results)
+		if (self.replay_error is not None):
+			raise self.replay_error
+		if results[name] and (name in self.failed):
+			self.failed.remove(name)
+
+	def replay(self):
+		# Run the sampler entry points marked in the trace, in trace
+		# order, as fast as possible (no timers, no conversion wait)
+		# Raise TraceMismatch if the trace does not match drivers/conf
+		if (self.replay_error is not None):
+			raise self.replay_error
+
+		handlers = {
+			ADT7410_ADDR: {
+				i2ctrace.MARK_INIT: lambda: self.replay_init(DEV_TEMP),
+				i2ctrace.MARK_START: self.temperature_start,
+				i2ctrace.MARK_SAMPLE: self.temperature_sample,
+				i2ctrace.MARK_PROGRAM: lambda: self.temperature_program(self.sensor_temp),
+			},
+			VL53L0X_ADDR: {
+				i2ctrace.MARK_INIT: lambda: self.replay_init(DEV_RANGE),
+				i2ctrace.MARK_SAMPLE: self.range_sample,
+			},
+			i2ctrace.MONITOR_ADDRESS: {
+				i2ctrace.MARK_RULE: self.replay_rule,
+			},
+		}
+
+		start = time.monotonic()
+		trace_start = self.clock()
+		samples = 0
+		while True:
+			pending = []
+			for address in handlers:
+				record = self.replay_bus.peek(address)
+				if (record is not None):
+					pending.append(record + (address,))
+			if not pending:
+				break
+
+			seq, op, kind, address = min(pending)
+			if (op != i2ctrace.OP_MARK) or (kind not in handlers[address]):
+				raise i2ctrace.TraceMismatch('0x{:02x}: unmarked transaction op {} reg 0x{:02x}'.format(
+					address, op, kind))
+			try:
+				handlers[address][kind]()
+			except i2ctrace.TraceEnd:
+				# Truncated trace, last sample is incomplete
+				break
+			samples += 1
+
+		elapsed = time.monotonic() - start
+		print('Replayed {} samples, {:.0f}s of trace in {:.3f}s'.format(
+			samples, self.clock() - trace_start, elapsed))
 
 	def run(self):
 		self.temperature_poll()
 		self.range_poll()
-		self.send_event('STARTED')
+
+		if self.failed:
+			self.send_event('STARTED: failed=' + ','.join(self.failed))
+			self.retry_source = GLib.timeout_add_seconds(INIT_RETRY_S, self.init_retry)
+		else:
+			self.send_event('STARTED')
+		print('Ready in {:.3f}s'.format(time.monotonic() - self.start_time))
+
 		loop = GLib.MainLoop()
 
 		try:
@@ -213,11 +711,31 @@ class CellularMonitor(object):
 			print('Interrupted')
 			self.save_config()
 
+		if (self.trace is not None):
+			self.trace.close()
+		if (self.capture is not None):
+			self.capture.stop()
+
 		print('exit')
 
 def main():
-	watch = CellularMonitor()
-	watch.run()
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--config', default='/etc/cellularmonitor.json')
+	parser.add_argument('--record', metavar='TRACE',
+			help='record i2c transactions to TRACE')
+	parser.add_argument('--replay', metavar='TRACE',
+			help='replay i2c transactions from TRACE and exit')
+	args = parser.parse_args()
+
+	watch = CellularMonitor(args.config, record=args.record, replay=args.replay)
+	if (args.replay is not None):
+		try:
+			watch.replay()
+		except i2ctrace.TraceMismatch as e:
+			print('Replay aborted: ' + str(e))
+			sys.exit(1)
+	else:
+		watch.run()
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,217 @@
+import os
+import errno
+import struct
+import threading
+import time
+import collections
+
+# Trace file record: timestamp (ms since previous record), op, address,
+# register, data length, followed by data bytes.
+RECORD = struct.Struct('<IBBBB')
+
+OP_READ_BYTE   = 0
+OP_WRITE_BYTE  = 1
+OP_READ_BLOCK  = 2
+OP_WRITE_BLOCK = 3
+# Marker record, register is the MARK_* entry point of the next records
+OP_MARK        = 4
+# Failed transaction flag, data is the errno
+OP_ERROR       = 0x80
+
+# Sampler entry points, replay dispatches on them
+MARK_INIT      = 0
+MARK_START     = 1
+MARK_SAMPLE    = 2
+MARK_PROGRAM   = 3
+# Monitor event, data is JSON
+MARK_RULE      = 4
+
+# Pseudo device address for monitor (non bus) events
+MONITOR_ADDRESS = 0x00
+
+# Flush the trace file at most every TRACE_FLUSH_S
+TRACE_FLUSH_S = 1
+
+class TraceMismatch(RuntimeError):
+	pass
+
+class TraceEnd(TraceMismatch):
+	pass
+
+class TraceStepEnd(RuntimeError):
+	"""The recorded step stopped before this transaction, e.g. driver
+	timeout, replayed as a driver failure."""
+	pass
+
+class TraceWriter(object):
+	"""Write bus transactions to a trace file, shared by several TraceBus."""
+
+	def __init__(self, path):
+		self.file = open(path, 'wb')
+		self.lock = threading.Lock()
+		self.last = int(time.monotonic() * 1000)
+		self.last_flush = self.last
+
+	def record(self, op, address, reg, data):
+		# Never raise into the driver path, stop tracing on error
+		with self.lock:
+			if self.file is None:
+				return
+			try:
+				now = int(time.monotonic() * 1000)
+				delta = min(now - self.last, 0xFFFFFFFF)
+				self.last = now
+				self.file.write(RECORD.pack(delta, op, address, reg, len(data)))
+				self.file.write(bytes(data))
+				if (now - self.last_flush) >= TRACE_FLUSH_S * 1000:
+					self.file.flush()
+					self.last_flush = now
+			except Exception as e:
+				print('Unable to write trace, stop tracing: ' + str(e))
+				self.__close()
+
+	def mark(self, address, kind, data=b''):
+		if len(data) > 0xFF:
+			print('Trace marker data too long, not recorded')
+			return
+		self.record(OP_MARK, address, kind, data)
+
+	def __close(self):
+		try:
+			self.file.close()
+		except Exception as e:
+			print('Unable to close trace: ' + str(e))
+		self.file = None
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.__close()
+
+class TraceBus(object):
+	"""smbus wrapper recording every transaction."""
+
+	def __init__(self, bus, writer):
+		self.bus = bus
+		self.writer = writer
+
+	def __error(self, op, address, reg, e):
+		# Record failed transaction (e.g. NACK/EIO)
+		err = getattr(e, 'errno', None) or errno.EIO
+		self.writer.record(op | OP_ERROR, address, reg, [err & 0xFF])
+
+	def read_byte_data(self, address, reg):
+		try:
+			val = self.bus.read_byte_data(address, reg)
+		except IOError as e:
+			self.__error(OP_READ_BYTE, address, reg, e)
+			raise
+		self.writer.record(OP_READ_BYTE, address, reg, [val])
+		return val
+
+	def write_byte_data(self, address, reg, val):
+		try:
+			self.bus.write_byte_data(address, reg, val)
+		except IOError as e:
+			self.__error(OP_WRITE_BYTE, address, reg, e)
+			raise
+		self.writer.record(OP_WRITE_BYTE, address, reg, [val & 0xFF])
+
+	def read_i2c_block_data(self, address, reg, length):
+		try:
+			data = self.bus.read_i2c_block_data(address, reg, length)
+		except IOError as e:
+			self.__error(OP_READ_BLOCK, address, reg, e)
+			raise
+		self.writer.record(OP_READ_BLOCK, address, reg, data)
+		return data
+
+	def write_i2c_block_data(self, address, reg, data):
+		try:
+			self.bus.write_i2c_block_data(address, reg, data)
+		except IOError as e:
+			self.__error(OP_WRITE_BLOCK, address, reg, e)
+			raise
+		self.writer.record(OP_WRITE_BLOCK, address, reg, data)
+
+def load(path):
+	"""Return the list of (timestamp_s, op, address, reg, data) records."""
+	records = []
+	with open(path, 'rb') as f:
+		buf = f.read()
+	offset = 0
+	ts = 0
+	while offset + RECORD.size <= len(buf):
+		delta, op, address, reg, length = RECORD.unpack_from(buf, offset)
+		ts += delta
+		offset += RECORD.size
+		data = buf[offset:offset + length]
+		if len(data) < length:
+			# Truncated record (e.g. power loss)
+			break
+		offset += length
+		records.append((ts / 1000.0, op, address, reg, data))
+	return records
+
+class ReplayBus(object):
+	"""smbus replacement returning recorded transactions.
+
+	Records are queued per device address, so devices can be replayed in
+	any interleaving (e.g. concurrent init) as long as each device issues
+	the same transactions as recorded.
+	"""
+
+	def __init__(self, path):
+		self.streams = collections.defaultdict(collections.deque)
+		for seq, (ts, op, address, reg, data) in enumerate(load(path)):
+			self.streams[address].append((ts, op, reg, data, seq))
+		self.now = 0.0
+
+	def peek(self, address):
+		"""(seq, op, reg) of the next record for address, None if
+		exhausted. seq is the record position in the trace."""
+		stream = self.streams.get(address)
+		if not stream:
+			return None
+		ts, op, reg, data, seq = stream[0]
+		return (seq, op, reg)
+
+	def mark(self, address, kind):
+		"""Consume marker record, return its data."""
+		return self.__next(OP_MARK, address, kind)
+
+	def clock(self):
+		"""Trace time of the last replayed transaction."""
+		return self.now
+
+	def __next(self, op, address, reg, data=None):
+		stream = self.streams[address]
+		if (op != OP_MARK) and ((not stream) or (stream[0][1] == OP_MARK)):
+			raise TraceStepEnd('0x{:02x}: recorded step ended'.format(address))
+		if not stream:
+			raise TraceEnd('End of trace for 0x{:02x}'.format(address))
+		ts, rop, rreg, rdata, seq = stream.popleft()
+		self.now = ts
+		if ((rop & ~OP_ERROR) != op) or (rreg != reg):
+			raise TraceMismatch('0x{:02x}: expected op {} reg 0x{:02x}, got op {} reg 0x{:02x}'.format(
+				address, rop, rreg, op, reg))
+		if rop & OP_ERROR:
+			# Replay recorded bus error
+			err = rdata[0] if rdata else errno.EIO
+			raise IOError(err, os.strerror(err))
+		if (data is not None) and (bytes(data) != rdata):
+			raise TraceMismatch('0x{:02x}: write data mismatch on reg 0x{:02x}'.format(
+				address, reg))
+		return rdata
+
+	def read_byte_data(self, address, reg):
+		return self.__next(OP_READ_BYTE, address, reg)[0]
+
+	def write_byte_data(self, address, reg, val):
+		self.__next(OP_WRITE_BYTE, address, reg, [val & 0xFF])
+
+	def read_i2c_block_data(self, address, reg, length):
+		return list(self.__next(OP_READ_BLOCK, address, reg))
+
+	def write_i2c_block_data(self, address, reg, data):
+		self.__next(OP_WRITE_BLOCK, address, reg, data)
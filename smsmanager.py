@@ -1,4 +1,8 @@
 import dbus
+import time
+import collections
+
+from gi.repository import GLib
 
 MM_SERVICE = 'org.freedesktop.ModemManager1'
 MM_OBJPATH = '/org/freedesktop/ModemManager1'
@@ -10,28 +14,151 @@ SMS_IFACE = 'org.freedesktop.ModemManager1.Sms'
 MDM_IFACE = 'org.freedesktop.ModemManager1.Modem'
 MSG_IFACE = 'org.freedesktop.ModemManager1.Modem.Messaging'
 
+# MMModemState
+MM_MODEM_STATE_DISABLED   = 3
+MM_MODEM_STATE_REGISTERED = 8
+
+# Max number of outgoing messages held while no modem is ready
+SEND_QUEUE_LEN = 16
+# Delay before retrying to send queued messages after a failure
+SEND_RETRY_S = 30
+# Max number of attempts before dropping a message
+SEND_RETRIES = 5
+
 class SMSManager(object):
 	def __init__(self, sms_cb):
+		self.sms_cb = sms_cb
+		self.device = None
+		self.device_path = None
+		self.ready = False
+		self.signals = []
+		self.queue = collections.deque(maxlen=SEND_QUEUE_LEN)
+		self.retry_source = None
+		self.send_failures = 0
+		self.lost_time = None
+		self.reconnect_time = None
+		self.reconnect_count = 0
+
 		self.bus = dbus.SystemBus()
-		om = dbus.Interface(self.bus.get_object(MM_SERVICE, MM_OBJPATH),
-							OBJMANAGER_IFACE)
+		self.owner = self.bus.get_name_owner(MM_SERVICE)
 
-		objects = om.GetManagedObjects()
-		# Retrieve modem list
-		if not len(objects):
-			raise RuntimeError("No modem found")
+		# Watch modem (re)enumeration
+		self.bus.add_signal_receiver(self.__interfaces_added,
+					bus_name=MM_SERVICE,
+					dbus_interface=OBJMANAGER_IFACE,
+					signal_name="InterfacesAdded",
+					path=MM_OBJPATH)
+		self.bus.add_signal_receiver(self.__interfaces_removed,
+					bus_name=MM_SERVICE,
+					dbus_interface=OBJMANAGER_IFACE,
+					signal_name="InterfacesRemoved",
+					path=MM_OBJPATH)
 
-		for path in objects.keys():
-			self.device = self.bus.get_object(MM_SERVICE, path)
-			break
+		if not self.__bind_first():
+			print('No modem found, waiting for modem')
 
-		self.device.Enable(True, dbus_interface=MDM_IFACE)
+		# ModemManager restart does not emit InterfacesRemoved
+		self.bus.watch_name_owner(MM_SERVICE, self.__name_owner_changed)
 
-		self.sms_cb = sms_cb
-		self.bus.add_signal_receiver(self.__sms_added,
+	def __bind_first(self):
+		# Proxies are bound to the current ModemManager instance
+		om = dbus.Interface(self.bus.get_object(MM_SERVICE, MM_OBJPATH),
+							OBJMANAGER_IFACE)
+		objects = om.GetManagedObjects()
+		for path, interfaces in objects.items():
+			if MDM_IFACE in interfaces:
+				self.__bind(path)
+				return True
+		return False
+
+	def __bind(self, path):
+		print('Bind modem ' + path)
+		self.device = self.bus.get_object(MM_SERVICE, path)
+		self.device_path = path
+		self.signals = [
+			self.bus.add_signal_receiver(self.__sms_added,
 					bus_name=MM_SERVICE,
 					dbus_interface=MSG_IFACE,
-					signal_name="Added")
+					signal_name="Added",
+					path=path),
+			self.bus.add_signal_receiver(self.__state_changed,
+					bus_name=MM_SERVICE,
+					dbus_interface=MDM_IFACE,
+					signal_name="StateChanged",
+					path=path),
+		]
+
+		try:
+			self.device.Enable(True, dbus_interface=MDM_IFACE)
+			state = self.device.Get(MDM_IFACE, 'State', dbus_interface=PROP_IFACE)
+		except dbus.DBusException as e:
+			print('Unable to enable modem: ' + str(e))
+			return
+		self.__state_update(state)
+
+	def __unbind(self):
+		print('Unbind modem ' + self.device_path)
+		for signal in self.signals:
+			signal.remove()
+		self.signals = []
+		self.device = None
+		self.device_path = None
+		self.__set_ready(False)
+
+	def __set_ready(self, ready):
+		if ready == self.ready:
+			return
+		self.ready = ready
+		now = time.monotonic()
+
+		if not ready:
+			print('Modem lost')
+			self.lost_time = now
+			return
+
+		if self.lost_time is not None:
+			self.reconnect_time = now - self.lost_time
+			self.reconnect_count += 1
+			print('Modem reconnected in {:.3f}s'.format(self.reconnect_time))
+		self.lost_time = None
+		self.__flush()
+
+	def __name_owner_changed(self, owner):
+		if owner == self.owner:
+			return
+		print('ModemManager owner changed: ' + (owner or 'none'))
+		self.owner = owner
+		if (self.device is not None):
+			self.__unbind()
+		if not owner:
+			return
+		try:
+			self.__bind_first()
+		except dbus.DBusException as e:
+			print('Unable to retrieve modems: ' + str(e))
+
+	def __interfaces_added(self, path, interfaces):
+		if (self.device is None) and (MDM_IFACE in interfaces):
+			self.__bind(path)
+
+	def __interfaces_removed(self, path, interfaces):
+		if (path != self.device_path) or (MDM_IFACE not in interfaces):
+			return
+		self.__unbind()
+		self.__bind_first()
+
+	def __state_changed(self, old, new, reason):
+		print('Modem state {} -> {}'.format(old, new))
+		self.__state_update(new)
+
+	def __state_update(self, state):
+		if state == MM_MODEM_STATE_DISABLED:
+			# e.g. modem reset, re-enable it
+			try:
+				self.device.Enable(True, dbus_interface=MDM_IFACE)
+			except dbus.DBusException as e:
+				print('Unable to enable modem: ' + str(e))
+		self.__set_ready(state >= MM_MODEM_STATE_REGISTERED)
 
 	def __sms_added(self, path, received):
 		if (received == False):
@@ -42,7 +169,7 @@ class SMSManager(object):
 		number = sms_prop.Get(SMS_IFACE, 'Number')
 		self.sms_cb(message, number)
 
-	def send(self, number, message):
+	def __send(self, number, message):
 		msg = dbus.Dictionary({
 					dbus.String('number') : dbus.String(number),
  					dbus.String('text') : dbus.String(message)
@@ -52,3 +179,50 @@ class SMSManager(object):
 
 		sms = self.bus.get_object(MM_SERVICE, sms_path)
 		sms.Send(dbus_interface=SMS_IFACE)
+
+	def __flush(self):
+		# Send queued messages in order, retry later on failure
+		while self.queue and self.ready:
+			number, message = self.queue[0]
+			try:
+				self.__send(number, message)
+			except dbus.DBusException as e:
+				self.send_failures += 1
+				if self.send_failures >= SEND_RETRIES:
+					print('Unable to send message, drop it: ' + str(e))
+					self.send_failures = 0
+					self.queue.popleft()
+					continue
+				print('Unable to send message, retry later: ' + str(e))
+				if self.retry_source is None:
+					self.retry_source = GLib.timeout_add_seconds(SEND_RETRY_S,
+										self.__retry)
+				return
+			self.send_failures = 0
+			self.queue.popleft()
+
+	def __retry(self):
+		self.retry_source = None
+		self.__flush()
+		return False
+
+	def send(self, number, message):
+		# Hold the message until a modem is ready, keep FIFO order
+		if len(self.queue) == self.queue.maxlen:
+			print('Send queue full, drop oldest message')
+		self.queue.append((number, message))
+		if not self.ready:
+			print('Modem not ready, queue message')
+			return
+		if self.retry_source is not None:
+			# Earlier messages pending, sent by retry
+			return
+		self.__flush()
+
+	def status(self):
+		status = 'modem: {};queued={};reconnects={}'.format(
+			'ready' if self.ready else 'not ready',
+			len(self.queue), self.reconnect_count)
+		if self.reconnect_time is not None:
+			status += ';last={:.1f}s'.format(self.reconnect_time)
+		return status